@@ -9,35 +9,35 @@ import aiohttp
 import json
 import time
 import logging
-from typing import List
-from aiortc import RTCPeerConnection, RTCSessionDescription
-from aiortc.contrib.media import MediaBlackhole
+import sys
+from typing import List, Optional
+from aiortc import AudioStreamTrack, RTCPeerConnection, RTCSessionDescription
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 정리 시 동시에 닫을 클라이언트 수
+CLEANUP_CONCURRENCY = 64
+
 class LoadTestClient:
-    def __init__(self, client_id: int, server_url: str):
+    def __init__(self, client_id: int, server_url: str, session: aiohttp.ClientSession):
         self.client_id = client_id
         self.server_url = server_url
         self.pc = None
-        self.session = None
+        self.session = session  # LoadTester가 소유하는 공유 세션
         self.connected = False
+        self._connected_event = asyncio.Event()
         self.start_time = None
         self.connect_time = None
 
-    async def connect(self) -> bool:
-        """WebRTC 연결 시도"""
+    async def connect(self, timeout: float = 10.0) -> bool:
+        """WebRTC 연결 시도 (ICE 연결 완료까지 포함)"""
         try:
             self.start_time = time.time()
             self.pc = RTCPeerConnection()
-            self.session = aiohttp.ClientSession()
 
             # 가상 오디오 트랙 추가 (실제 마이크 대신)
-            # MediaBlackhole 인스턴스 생성 후 audio 트랙 가져오기
-            blackhole = MediaBlackhole()
-            audio_track = blackhole.audio
-            self.pc.addTrack(audio_track)
+            self.pc.addTrack(AudioStreamTrack())
 
             # 연결 상태 모니터링
             @self.pc.on("connectionstatechange")
@@ -45,8 +45,9 @@ class LoadTestClient:
                 if self.pc.connectionState == "connected" and not self.connected:
                     self.connect_time = time.time()
                     self.connected = True
+                    self._connected_event.set()
                     duration = (self.connect_time - self.start_time) * 1000
-                    logger.info(f"Client {self.client_id}: Connected in {duration:.1f}ms")
+                    logger.info("Client %d: Connected in %.1fms", self.client_id, duration)
 
             # Offer 생성 및 전송
             offer = await self.pc.createOffer()
@@ -71,10 +72,11 @@ class LoadTestClient:
                 )
                 await self.pc.setRemoteDescription(answer)
 
-            return True
+            # 시그널링 직후 바로 연결 완료를 기다려 한 번의 gather로 전체 연결 시간 측정
+            return await self.wait_for_connection(timeout)
 
         except Exception as e:
-            logger.error(f"Client {self.client_id}: Connection failed - {e}")
+            logger.error("Client %d: Connection failed - %s", self.client_id, e)
             await self.cleanup()
             return False
 
@@ -82,68 +84,96 @@ class LoadTestClient:
         """연결 정리"""
         if self.pc:
             await self.pc.close()
-        if self.session:
-            await self.session.close()
 
     async def wait_for_connection(self, timeout: float = 10.0) -> bool:
-        """연결 완료까지 대기"""
-        end_time = time.time() + timeout
-        while time.time() < end_time:
-            if self.connected:
-                return True
-            await asyncio.sleep(0.1)
-        return False
+        """연결 완료까지 대기 (폴링 없이 이벤트로 대기)"""
+        try:
+            await asyncio.wait_for(self._connected_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
 class LoadTester:
-    def __init__(self, server_url: str = "http://localhost:8080"):
+    def __init__(self, server_url: str = "http://localhost:8080", concurrent_limit: int = 50,
+                 pool_size: Optional[int] = None, hold_connections: bool = False):
         self.server_url = server_url
+        # 기본은 배치가 끝날 때마다 정리하여 메모리를 일정하게 유지
+        # hold_connections=True면 동시 접속 유지 테스트를 위해 끝까지 연결을 보관
+        self.hold_connections = hold_connections
         self.clients: List[LoadTestClient] = []
+        self.cleaned_up = 0
+        # 모든 클라이언트가 하나의 세션(커넥션 풀)을 공유하여 keep-alive 연결 재사용
+        # aiohttp 기본값(limit=100)은 동시 요청을 조용히 대기열에 넣어 연결 시간을 부풀리므로
+        # 전체 한도는 해제(limit=0)하고 호스트당 한도만 지정
+        if pool_size is None:
+            pool_size = max(concurrent_limit, 256)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=pool_size,
+                ttl_dns_cache=300,
+                keepalive_timeout=30
+            )
+        )
 
-    async def run_test(self, num_clients: int, concurrent_limit: int = 50):
+    async def run_test(self, num_clients: int, concurrent_limit: int = 50, batch_cooldown: float = 1.0):
         """부하 테스트 실행"""
-        logger.info(f"Starting load test with {num_clients} clients")
-        logger.info(f"Concurrent connection limit: {concurrent_limit}")
+        logger.info("Starting load test with %d clients", num_clients)
+        logger.info("Concurrent connection limit: %d", concurrent_limit)
         
         start_time = time.time()
         successful_connections = 0
         failed_connections = 0
+        consecutive_fail_batches = 0
 
         # 클라이언트들을 배치 단위로 처리
         for batch_start in range(0, num_clients, concurrent_limit):
             batch_end = min(batch_start + concurrent_limit, num_clients)
             batch_size = batch_end - batch_start
             
-            logger.info(f"Processing batch {batch_start}-{batch_end-1} ({batch_size} clients)")
+            logger.info("Processing batch %d-%d (%d clients)", batch_start, batch_end-1, batch_size)
             
             # 배치 내 클라이언트들 생성
             batch_clients = []
             for i in range(batch_start, batch_end):
-                client = LoadTestClient(i, self.server_url)
+                client = LoadTestClient(i, self.server_url, self.session)
                 batch_clients.append(client)
-                self.clients.append(client)
 
             # 동시 연결 시도
             batch_start_time = time.time()
-            connection_tasks = [client.connect() for client in batch_clients]
-            results = await asyncio.gather(*connection_tasks, return_exceptions=True)
-
-            # 연결 완료 대기
-            wait_tasks = [client.wait_for_connection() for client in batch_clients]
-            connection_results = await asyncio.gather(*wait_tasks, return_exceptions=True)
+            if sys.version_info >= (3, 11):
+                # TaskGroup은 gather보다 태스크별 관리 비용이 적음 (connect()는 예외를 내부에서 처리)
+                async with asyncio.TaskGroup() as tg:
+                    connection_tasks = [tg.create_task(client.connect()) for client in batch_clients]
+                results = [task.result() for task in connection_tasks]
+            else:
+                connection_tasks = [client.connect() for client in batch_clients]
+                results = await asyncio.gather(*connection_tasks, return_exceptions=True)
 
             # 결과 집계
-            batch_successful = sum(1 for result in connection_results if result is True)
+            batch_successful = sum(1 for result in results if result is True)
             batch_failed = batch_size - batch_successful
             
             successful_connections += batch_successful
             failed_connections += batch_failed
             
             batch_duration = time.time() - batch_start_time
-            logger.info(f"Batch completed in {batch_duration:.1f}s: {batch_successful} success, {batch_failed} failed")
+            logger.info("Batch completed in %.1fs: %d success, %d failed", batch_duration, batch_successful, batch_failed)
 
-            # 배치 간 잠시 대기 (서버 부하 분산)
+            if self.hold_connections:
+                self.clients.extend(batch_clients)
+            else:
+                await self.cleanup_clients(batch_clients)
+                self.cleaned_up += batch_size
+
+            # 실패가 있었던 배치 뒤에만 지수적으로 늘어나는 대기 (서버 부하 분산)
             if batch_end < num_clients:
-                await asyncio.sleep(1)
+                if batch_failed:
+                    await asyncio.sleep(min(8.0, batch_cooldown * 2 ** consecutive_fail_batches))
+                    consecutive_fail_batches += 1
+                else:
+                    consecutive_fail_batches = 0
+                    await asyncio.sleep(0)
 
         total_duration = time.time() - start_time
         
@@ -151,12 +181,12 @@ class LoadTester:
         logger.info("=" * 50)
         logger.info("LOAD TEST RESULTS")
         logger.info("=" * 50)
-        logger.info(f"Total clients: {num_clients}")
-        logger.info(f"Successful connections: {successful_connections}")
-        logger.info(f"Failed connections: {failed_connections}")
-        logger.info(f"Success rate: {(successful_connections/num_clients)*100:.1f}%")
-        logger.info(f"Total test duration: {total_duration:.1f}s")
-        logger.info(f"Average time per client: {(total_duration/num_clients)*1000:.1f}ms")
+        logger.info("Total clients: %d", num_clients)
+        logger.info("Successful connections: %d", successful_connections)
+        logger.info("Failed connections: %d", failed_connections)
+        logger.info("Success rate: %.1f%%", (successful_connections/num_clients)*100)
+        logger.info("Total test duration: %.1fs", total_duration)
+        logger.info("Average time per client: %.1fms", (total_duration/num_clients)*1000)
 
         return {
             "total_clients": num_clients,
@@ -168,9 +198,19 @@ class LoadTester:
 
     async def cleanup_all(self):
         """모든 클라이언트 정리"""
-        logger.info(f"Cleaning up {len(self.clients)} clients...")
-        cleanup_tasks = [client.cleanup() for client in self.clients]
-        await asyncio.gather(*cleanup_tasks, return_exceptions=True)
+        logger.info("Cleaning up %d clients (%d already closed per batch)...", len(self.clients), self.cleaned_up)
+        await self.cleanup_clients(self.clients)
+        await self.session.close()
+
+    async def cleanup_clients(self, clients: List[LoadTestClient]):
+        """동시 종료 수를 제한하여 클라이언트 정리"""
+        sem = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+
+        async def cleanup(client: LoadTestClient):
+            async with sem:
+                await client.cleanup()
+
+        await asyncio.gather(*(cleanup(client) for client in clients), return_exceptions=True)
 
 async def main():
     """메인 테스트 함수"""
@@ -179,14 +219,21 @@ async def main():
     parser = argparse.ArgumentParser(description="WebRTC Echo Server Load Test")
     parser.add_argument("--clients", type=int, default=50, help="Number of clients to simulate")
     parser.add_argument("--concurrent", type=int, default=10, help="Concurrent connection limit")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="HTTP connection pool size per host (default: max(concurrent, 256)); "
+                             "raise `ulimit -n` accordingly")
+    parser.add_argument("--batch-cooldown", type=float, default=1.0,
+                        help="Base backoff in seconds after a batch with failures (doubles per failing batch, max 8s)")
+    parser.add_argument("--hold", action="store_true",
+                        help="Keep every connection open until the end instead of closing each batch")
     parser.add_argument("--url", default="http://localhost:8080", help="Server URL")
     
     args = parser.parse_args()
     
-    tester = LoadTester(args.url)
+    tester = LoadTester(args.url, args.concurrent, args.pool_size, args.hold)
     
     try:
-        results = await tester.run_test(args.clients, args.concurrent)
+        results = await tester.run_test(args.clients, args.concurrent, args.batch_cooldown)
         
         # 성능 평가
         if results["success_rate"] >= 95:
@@ -202,4 +249,8 @@ async def main():
         await tester.cleanup_all()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    # 기본 asyncio 루프 대신 libuv 기반 uvloop 사용
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    asyncio.run(main())
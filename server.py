@@ -1,58 +1,142 @@
 # server.py
-import argparse
 import asyncio
-import json
+import collections
+import hashlib
 import logging
 import os
+import random
 import time
-import requests
-import base64
-from typing import Set, Dict, Any
+import uuid
+import weakref
+from typing import Optional
 
-from aiohttp import web
+import aiohttp
+import orjson
+from aiohttp import web, WSMsgType
 from aiohttp_cors import setup as cors_setup, ResourceOptions
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack, RTCConfiguration, RTCIceServer
-from aiortc.contrib.media import MediaBlackhole
+from aiortc.sdp import candidate_from_sdp
 
-# Twilio SDK 추가
-from twilio.rest import Client
+logger = logging.getLogger(__name__)
 
 # Twilio 및 Railway 환경 관련 코드 - Twilio ICE 서버 사용으로 변경
 _ice_servers_cache = None
+_ice_servers_cache_json = b""  # 직렬화된 iceServers 목록
+_rtc_ice_servers_cache = []  # aiortc용 RTCIceServer 목록
 _cache_timestamp = 0
 _cache_ttl = 3600  # 1시간
 
-def get_ice_servers():
+# 클라이언트 ICE 전송 정책: "all"(기본, 직접 연결 우선) 또는 "relay"(TURN 강제, 대칭형 NAT 환경용)
+# aiortc는 iceTransportPolicy를 지원하지 않으므로 브라우저 쪽에 전달하여 적용
+ICE_POLICIES = ("all", "relay")
+ICE_POLICY = os.environ.get("ICE_POLICY", "all").strip().lower()
+if ICE_POLICY not in ICE_POLICIES:
+    # 잘못된 값이 브라우저로 가면 RTCPeerConnection 생성 자체가 실패하므로 기본값 사용
+    logger.warning("⚠️ 알 수 없는 ICE_POLICY=%r, 'all' 사용 (허용: %s)", os.environ.get("ICE_POLICY"), ", ".join(ICE_POLICIES))
+    ICE_POLICY = "all"
+_ICE_POLICY_JSON = orjson.dumps(ICE_POLICY)
+# TTL의 약 80% 지점(±10% 지터)부터 백그라운드에서 미리 갱신하여 요청이 만료를 기다리지 않도록 함
+_cache_soft_deadline = 0
+_refresh_task: Optional[asyncio.Future] = None
+# 백그라운드 갱신 실패 후 다음 재시도까지 대기 시간 (Twilio 장애/429 시 요청마다 재호출 방지)
+ICE_REFRESH_RETRY_INTERVAL = 60
+
+def set_ice_servers_cache(ice_servers, timestamp):
+    """ICE 서버 캐시와 파생 데이터(JSON, RTCIceServer)를 함께 갱신"""
+    global _ice_servers_cache, _ice_servers_cache_json, _rtc_ice_servers_cache, _cache_timestamp, _cache_soft_deadline
+    _ice_servers_cache_json = orjson.dumps(ice_servers)
+    _rtc_ice_servers_cache = convert_to_rtc_ice_servers(ice_servers)
+    _ice_servers_cache = ice_servers
+    _cache_timestamp = timestamp
+    _cache_soft_deadline = timestamp + _cache_ttl * (0.8 + random.uniform(-0.1, 0.1))
+
+def clear_ice_servers_cache():
+    """ICE 서버 캐시 초기화"""
+    global _ice_servers_cache, _ice_servers_cache_json, _rtc_ice_servers_cache, _cache_timestamp, _cache_soft_deadline
+    _ice_servers_cache = None
+    _ice_servers_cache_json = b""
+    _rtc_ice_servers_cache = []
+    _cache_timestamp = 0
+    _cache_soft_deadline = 0
+
+TWILIO_TOKENS_URL = "https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Tokens.json"
+
+# Twilio 요청용 공유 세션과 동시 캐시 미스 시 한 번만 가져오기 위한 락 (앱 시작 시 생성)
+_twilio_session: Optional[aiohttp.ClientSession] = None
+_ice_fetch_lock: Optional[asyncio.Lock] = None
+
+def is_ice_cache_fresh(current_time: float) -> bool:
+    return bool(_ice_servers_cache) and (current_time - _cache_timestamp) < _cache_ttl
+
+async def fetch_twilio_ice_servers(account_sid: str, auth_token: str):
+    """Twilio Network Traversal Token API를 이벤트 루프를 막지 않고 호출"""
+    async with _twilio_session.post(
+        TWILIO_TOKENS_URL.format(account_sid=account_sid),
+        auth=aiohttp.BasicAuth(account_sid, auth_token),
+        timeout=aiohttp.ClientTimeout(total=3)
+    ) as response:
+        response.raise_for_status()
+        token = await response.json(loads=orjson.loads)
+
+    ice_servers = []
+    for ice_server in token["ice_servers"]:
+        ice_servers.append({
+            "urls": ice_server.get("urls") or ice_server.get("url"),
+            "username": ice_server.get("username"),
+            "credential": ice_server.get("credential")
+        })
+    return ice_servers
+
+async def get_ice_servers():
     """Twilio ICE 서버 또는 환경변수 기반 coturn/무료 STUN 서버 제공"""
-    global _ice_servers_cache, _cache_timestamp
+    global _refresh_task
     current_time = time.time()
-    if _ice_servers_cache and (current_time - _cache_timestamp) < _cache_ttl:
+    if is_ice_cache_fresh(current_time):
+        # 만료가 가까우면 응답은 캐시로 하고 갱신은 백그라운드에서 한 번만 수행
+        if current_time > _cache_soft_deadline and (_refresh_task is None or _refresh_task.done()):
+            _refresh_task = asyncio.ensure_future(refresh_ice_servers_in_background())
         return _ice_servers_cache
 
+    async with _ice_fetch_lock:
+        # 락을 기다리는 동안 다른 요청이 이미 갱신했으면 그대로 사용
+        current_time = time.time()
+        if is_ice_cache_fresh(current_time):
+            return _ice_servers_cache
+        return await load_ice_servers(current_time)
+
+async def refresh_ice_servers_in_background():
+    """만료 전에 ICE 서버 캐시를 미리 갱신"""
+    global _cache_soft_deadline
+    try:
+        async with _ice_fetch_lock:
+            await load_ice_servers(time.time(), fallback=False)
+    except Exception as e:
+        # 실패해도 기존 캐시는 하드 만료 전까지 그대로 사용하고, 재시도는 일정 간격으로만 수행
+        _cache_soft_deadline = min(time.time() + ICE_REFRESH_RETRY_INTERVAL, _cache_timestamp + _cache_ttl)
+        logger.warning("⚠️ ICE 서버 백그라운드 갱신 실패 (기존 캐시 유지): %s", e)
+
+async def load_ice_servers(current_time: float, fallback: bool = True):
+    """ICE 서버 목록을 새로 가져와 캐시에 저장 (_ice_fetch_lock 안에서 호출)
+
+    fallback=False면 Twilio 실패 시 기본 서버로 바꾸지 않고 예외를 그대로 전달하여
+    아직 유효한 기존 캐시를 유지함 (백그라운드 갱신용)
+    """
     # Twilio ICE 서버 시도
     twilio_account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
     twilio_auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
     
     if twilio_account_sid and twilio_auth_token:
         try:
-            client = Client(twilio_account_sid, twilio_auth_token)
-            token = client.tokens.create()
+            ice_servers = await fetch_twilio_ice_servers(twilio_account_sid, twilio_auth_token)
             
-            ice_servers = []
-            for ice_server in token.ice_servers:
-                ice_servers.append({
-                    "urls": ice_server["urls"],
-                    "username": ice_server.get("username"),
-                    "credential": ice_server.get("credential")
-                })
-            
-            logging.info(f"🔄 Twilio ICE 서버 사용: {len(ice_servers)}개 서버")
-            _ice_servers_cache = ice_servers
-            _cache_timestamp = current_time
+            logger.info("🔄 Twilio ICE 서버 사용: %d개 서버", len(ice_servers))
+            set_ice_servers_cache(ice_servers, current_time)
             return ice_servers
             
         except Exception as e:
-            logging.warning(f"⚠️ Twilio ICE 서버 가져오기 실패: {e}")
+            if not fallback:
+                raise
+            logger.warning("⚠️ Twilio ICE 서버 가져오기 실패: %s", e)
     
     # Twilio 실패 시 기존 로직 사용
     # 환경변수 기반 coturn 정보
@@ -74,14 +158,18 @@ def get_ice_servers():
             "username": custom_turn_user,
             "credential": custom_turn_pass
         })
-        logging.info(f"🔄 환경변수 기반 coturn TURN 서버 사용: {custom_turn}")
+        logger.info("🔄 환경변수 기반 coturn TURN 서버 사용: %s", custom_turn)
     else:
-        logging.info("🔄 무료 STUN 서버만 사용 (TURN 미설정)")
+        logger.info("🔄 무료 STUN 서버만 사용 (TURN 미설정)")
 
-    _ice_servers_cache = default_servers
-    _cache_timestamp = current_time
+    set_ice_servers_cache(default_servers, current_time)
     return default_servers
 
+async def get_rtc_ice_servers():
+    """aiortc용 RTCIceServer 목록 (캐시 갱신 시 한 번만 변환)"""
+    await get_ice_servers()
+    return _rtc_ice_servers_cache
+
 def convert_to_rtc_ice_servers(ice_servers_data):
     """클라이언트용 ICE 서버 데이터를 aiortc RTCIceServer 객체로 변환"""
     rtc_ice_servers = []
@@ -113,8 +201,23 @@ def convert_to_rtc_ice_servers(ice_servers_data):
 
 ROOT = os.path.dirname(__file__)
 
+# 구간 시간 측정용 단조 시계 (이벤트 루프 조회 없이 바로 호출)
+now = time.monotonic
+
 # 전역 변수를 더 명확하게 타입 힌트와 함께
-pcs: Set[RTCPeerConnection] = set()
+# 종료된 연결은 connectionstatechange에서 제외하고, 누락된 경우에도 GC 시 WeakSet에서 빠짐
+pcs: weakref.WeakSet[RTCPeerConnection] = weakref.WeakSet()
+# trickle ICE용 연결 ID → PeerConnection
+pcs_by_id: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+# 동시에 PeerConnection 생성~SDP 처리를 진행할 offer 수
+OFFER_CONCURRENCY = int(os.environ.get("OFFER_CONCURRENCY", 32))
+
+# 요청 본문 최대 크기 (SDP offer는 16KB 미만)
+CLIENT_MAX_SIZE = 64 * 1024
+
+# 종료 시 동시에 닫을 PeerConnection 수
+SHUTDOWN_CLOSE_CONCURRENCY = 64
 
 # 서버 통계 정보
 server_stats = {
@@ -122,9 +225,32 @@ server_stats = {
     "total_connections": 0,
     "current_connections": 0,
     "failed_connections": 0,
-    "connection_times": []
+    "connection_times": collections.deque(maxlen=100),  # 최근 100개 연결 시간만 유지
+    # /stats 요청마다 다시 계산하지 않도록 연결 시점에 누적
+    "running_total_ms": 0.0,
+    "running_count": 0,
+    "recent_total_ms": 0.0  # 최근 10개 연결 시간 합계
 }
 
+RECENT_WINDOW = 10
+STATS_CACHE_TTL = 1.0
+HEALTH_CACHE_TTL = 0.5
+
+# 직렬화된 /stats 응답 캐시 (생성 시각, 본문)
+_stats_cache = (0.0, b"")
+# 직렬화된 /health 응답 캐시 (플랫폼 헬스 프로브 폴링용)
+_health_cache = (0.0, b"")
+
+def record_connection_time(total_time: float):
+    """연결 시간 기록 및 누적 통계 갱신"""
+    times = server_stats["connection_times"]
+    if len(times) >= RECENT_WINDOW:
+        server_stats["recent_total_ms"] -= times[-RECENT_WINDOW]
+    times.append(total_time)
+    server_stats["recent_total_ms"] += total_time
+    server_stats["running_total_ms"] += total_time
+    server_stats["running_count"] += 1
+
 class AudioEchoTrack(MediaStreamTrack):
     """음성을 그대로 다시 보내는 Echo Track"""
     kind = "audio"
@@ -132,123 +258,222 @@ class AudioEchoTrack(MediaStreamTrack):
     def __init__(self, track: MediaStreamTrack):
         super().__init__()
         self.track = track
+        self._recv = track.recv  # 프레임마다 속성 조회를 하지 않도록 미리 바인딩
 
     async def recv(self):
-        """받은 음성 프레임을 그대로 다시 전송"""
-        try:
-            frame = await self.track.recv()
-            return frame
-        except Exception as e:
-            logging.error(f"AudioEchoTrack recv error: {e}")
-            raise
+        """받은 음성 프레임을 그대로 다시 전송 (트랙 종료 시 MediaStreamError는 aiortc가 처리)"""
+        return await self._recv()
 
 async def index(request):
-    """메인 페이지 제공"""
-    return web.FileResponse(os.path.join(ROOT, "static/index.html"))
+    """메인 페이지 제공 (시작 시 메모리에 읽어 둔 내용 사용)"""
+    etag = request.app["index_etag"]
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(
+        body=request.app["index_body"],
+        content_type="text/html",
+        headers=headers
+    )
+
+class OfferContext:
+    """PeerConnection별 이벤트 핸들러 (offer마다 클로저를 만들지 않도록 바운드 메서드로 등록)"""
+    __slots__ = ("pc", "pc_id", "start_time")
+
+    def __init__(self, pc: RTCPeerConnection, pc_id: str, start_time: float):
+        self.pc = pc
+        self.pc_id = pc_id
+        self.start_time = start_time
+
+    def on_track(self, track: MediaStreamTrack):
+        track_received_time = now()
+        if track.kind == "audio":
+            logger.info("Received audio track (after %.1fms)", (track_received_time - self.start_time)*1000)
+            self.pc.addTrack(AudioEchoTrack(track))
+
+    async def on_connectionstatechange(self):
+        pc = self.pc
+        connection_time = now()
+        logger.info("Connection state changed: %s (after %.1fms)", pc.connectionState, (connection_time - self.start_time)*1000)
+        if pc.connectionState in ("failed", "closed"):
+            # WeakSet은 순환 참조가 GC될 때까지 남아 있으므로 종료된 연결은 바로 제외
+            if pc in pcs:
+                pcs.discard(pc)
+                logger.info("Removed PeerConnection. Total connections: %d", len(pcs))
+            pcs_by_id.pop(self.pc_id, None)
+            if pc.connectionState == "failed":
+                await pc.close()
+        elif pc.connectionState == "connected":
+            total_time = (connection_time - self.start_time) * 1000
+            record_connection_time(total_time)
+            logger.info("🎉 WebRTC connection established in %.1fms", total_time)
+
+# offer 실패 응답 본문 (클라이언트는 500만 확인하므로 상세 내용은 로그로만 남김)
+_OFFER_ERROR_BODY = b'{"error":"internal"}'
 
 async def offer(request):
     """WebRTC offer 처리 및 answer 생성"""
-    start_time = asyncio.get_event_loop().time()
+    start_time = now()
+    
+    # 크기가 큰 본문은 읽기 전에 바로 거절 (SDP offer는 16KB 미만)
+    if request.content_length is not None and request.content_length > CLIENT_MAX_SIZE:
+        raise web.HTTPRequestEntityTooLarge(max_size=CLIENT_MAX_SIZE, actual_size=request.content_length)
     
     try:
-        params = await request.json()
-        offer_received_time = asyncio.get_event_loop().time()
+        params = orjson.loads(await request.read())
+        offer_received_time = now()
         
         offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
         # 통일된 ICE 서버 설정 사용
-        ice_servers_data = get_ice_servers()
-        rtc_ice_servers = convert_to_rtc_ice_servers(ice_servers_data)
-        
-        pc = RTCPeerConnection(configuration=RTCConfiguration(
-            iceServers=rtc_ice_servers
-        ))
-        pcs.add(pc)
-        pc_created_time = asyncio.get_event_loop().time()
+        rtc_ice_servers = await get_rtc_ice_servers()
         
-        # 통계 업데이트
-        server_stats["total_connections"] += 1
-        
-        logging.info(f"Created PeerConnection with {len(rtc_ice_servers)} ICE servers. Total connections: {len(pcs)}")
-
-        @pc.on("track")
-        def on_track(track):
-            track_received_time = asyncio.get_event_loop().time()
-            if track.kind == "audio":
-                logging.info(f"Received audio track (after {(track_received_time - start_time)*1000:.1f}ms)")
-                pc.addTrack(AudioEchoTrack(track))
-
-        @pc.on("connectionstatechange")
-        async def on_connectionstatechange():
-            connection_time = asyncio.get_event_loop().time()
-            logging.info(f"Connection state changed: {pc.connectionState} (after {(connection_time - start_time)*1000:.1f}ms)")
-            if pc.connectionState in ["failed", "closed"]:
-                if pc in pcs:
-                    pcs.discard(pc)
-                    logging.info(f"Removed PeerConnection. Total connections: {len(pcs)}")
-            elif pc.connectionState == "connected":
-                total_time = (connection_time - start_time) * 1000
-                server_stats["connection_times"].append(total_time)
-                # 최근 100개 연결 시간만 유지
-                if len(server_stats["connection_times"]) > 100:
-                    server_stats["connection_times"] = server_stats["connection_times"][-100:]
-                logging.info(f"🎉 WebRTC connection established in {total_time:.1f}ms")
-
-        await pc.setRemoteDescription(offer)
-        remote_desc_time = asyncio.get_event_loop().time()
-        
-        answer = await pc.createAnswer()
-        answer_created_time = asyncio.get_event_loop().time()
-        
-        await pc.setLocalDescription(answer)
-        local_desc_time = asyncio.get_event_loop().time()
-
-        # 타이밍 정보 로깅
-        timings = {
-            "offer_processing": (offer_received_time - start_time) * 1000,
-            "pc_creation": (pc_created_time - offer_received_time) * 1000,
-            "remote_description": (remote_desc_time - pc_created_time) * 1000,
-            "answer_creation": (answer_created_time - remote_desc_time) * 1000,
-            "local_description": (local_desc_time - answer_created_time) * 1000,
-            "total_server_time": (local_desc_time - start_time) * 1000
+        # 동시에 처리하는 offer 수를 제한하여 버스트 시 이벤트 루프 보호
+        async with request.app["offer_semaphore"]:
+            pc = RTCPeerConnection(configuration=RTCConfiguration(
+                iceServers=rtc_ice_servers
+            ))
+            pcs.add(pc)
+            pc_id = uuid.uuid4().hex
+            pcs_by_id[pc_id] = pc
+            pc_created_time = now()
+            
+            # 통계 업데이트
+            server_stats["total_connections"] += 1
+            
+            logger.info("Created PeerConnection with %d ICE servers. Total connections: %d", len(rtc_ice_servers), len(pcs))
+
+            ctx = OfferContext(pc, pc_id, start_time)
+            pc.on("track", ctx.on_track)
+            pc.on("connectionstatechange", ctx.on_connectionstatechange)
+
+            await pc.setRemoteDescription(offer)
+            remote_desc_time = now()
+            
+            answer = await pc.createAnswer()
+            answer_created_time = now()
+            
+            await pc.setLocalDescription(answer)
+            local_desc_time = now()
+
+        answer_data = {
+            "sdp": pc.localDescription.sdp,
+            "type": pc.localDescription.type,
+            "pc_id": pc_id  # 이후 ICE candidate를 /ws로 보낼 때 사용
         }
-        
-        logging.info(f"Signaling timings: {timings}")
 
-        return web.Response(
+        # 타이밍 정보는 INFO 로그가 켜져 있거나 ?debug=1 요청일 때만 계산
+        debug = request.query.get("debug")
+        if debug or logger.isEnabledFor(logging.INFO):
+            timings = {
+                "offer_processing": (offer_received_time - start_time) * 1000,
+                "pc_creation": (pc_created_time - offer_received_time) * 1000,
+                "remote_description": (remote_desc_time - pc_created_time) * 1000,
+                "answer_creation": (answer_created_time - remote_desc_time) * 1000,
+                "local_description": (local_desc_time - answer_created_time) * 1000,
+                "total_server_time": (local_desc_time - start_time) * 1000
+            }
+            logger.info("Signaling timings: %s", timings)
+            if debug:
+                answer_data["server_timings"] = timings  # 클라이언트에서 참고할 수 있도록
+
+        response = web.Response(
             content_type="application/json",
-            text=json.dumps({
-                "sdp": pc.localDescription.sdp,
-                "type": pc.localDescription.type,
-                "server_timings": timings  # 클라이언트에서 참고할 수 있도록
-            })
+            body=orjson.dumps(answer_data)
         )
+        # SDP는 압축이 잘 되는 텍스트 (Accept-Encoding에 따라 aiohttp가 gzip/deflate 선택)
+        response.enable_compression()
+        return response
     
+    except web.HTTPException:
+        # read()의 413 등 HTTP 오류는 500으로 바꾸지 않고 그대로 전달
+        raise
     except Exception as e:
-        error_time = asyncio.get_event_loop().time()
+        error_time = now()
         server_stats["failed_connections"] += 1
-        logging.error(f"Error in offer handling after {(error_time - start_time)*1000:.1f}ms: {e}")
-        return web.Response(
-            status=500,
-            content_type="application/json",
-            text=json.dumps({"error": str(e)})
-        )
+        logger.error("Error in offer handling after %.1fms: %s", (error_time - start_time)*1000, e)
+        return web.Response(status=500, content_type="application/json", body=_OFFER_ERROR_BODY)
+
+async def ice_candidates_ws(request):
+    """클라이언트 ICE candidate를 WebSocket으로 받아 바로 추가 (trickle ICE)"""
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    pc = pcs_by_id.get(request.query.get("pc_id", ""))
+    if pc is None or pc.connectionState in ("closed", "failed"):
+        await ws.close(message=b"unknown pc_id")
+        return ws
+
+    # 연결이 끝나면 클라이언트가 소켓을 닫지 않아도 루프를 빠져나오도록 서버 쪽에서 닫음
+    def on_connectionstatechange():
+        if pc.connectionState in ("closed", "failed"):
+            asyncio.ensure_future(ws.close())
+
+    pc.on("connectionstatechange", on_connectionstatechange)
+    try:
+        async for msg in ws:
+            if pc.connectionState in ("closed", "failed"):
+                break
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                data = orjson.loads(msg.data)
+                if not data.get("candidate"):
+                    await pc.addIceCandidate(None)  # end-of-candidates
+                    break
+                candidate = candidate_from_sdp(data["candidate"].split(":", 1)[1])
+                candidate.sdpMid = data.get("sdpMid")
+                candidate.sdpMLineIndex = data.get("sdpMLineIndex")
+                await pc.addIceCandidate(candidate)
+            except Exception as e:
+                logger.warning("ICE candidate 처리 실패: %s", e)
+    finally:
+        pc.remove_listener("connectionstatechange", on_connectionstatechange)
+
+    await ws.close()
+    return ws
+
+async def on_startup(app):
+    """앱 시작 시 Twilio 세션과 offer 동시 처리 제한 준비"""
+    global _twilio_session, _ice_fetch_lock
+    _twilio_session = aiohttp.ClientSession()
+    _ice_fetch_lock = asyncio.Lock()
+    app["offer_semaphore"] = asyncio.Semaphore(OFFER_CONCURRENCY)
 
 async def on_shutdown(app):
     """앱 종료 시 모든 연결 정리"""
-    logging.info(f"Shutting down. Closing {len(pcs)} connections.")
-    coros = [pc.close() for pc in pcs]
-    await asyncio.gather(*coros, return_exceptions=True)
+    logger.info("Shutting down. Closing %d connections.", len(pcs))
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+    to_close = list(pcs)
+
+    # 수천 개의 DTLS 종료가 한꺼번에 몰리지 않도록 동시 종료 수 제한
+    sem = asyncio.Semaphore(SHUTDOWN_CLOSE_CONCURRENCY)
+
+    async def close(pc):
+        async with sem:
+            await pc.close()
+
+    await asyncio.gather(*(close(pc) for pc in to_close), return_exceptions=True)
     pcs.clear()
+    await _twilio_session.close()
 
 async def get_stats(request):
-    """서버 통계 정보 반환"""
+    """서버 통계 정보 반환 (짧은 시간 동안은 직렬화된 응답 재사용)"""
+    global _stats_cache
+    cached_at, body = _stats_cache
+    if body and now() - cached_at < STATS_CACHE_TTL:
+        response = web.Response(content_type="application/json", body=body)
+        response.enable_compression()
+        return response
+
     current_time = time.time()
     uptime = current_time - server_stats["start_time"]
     
-    # 최근 연결 시간 평균 계산 (최근 10개)
-    recent_times = server_stats["connection_times"][-10:]
-    avg_connection_time = sum(recent_times) / len(recent_times) if recent_times else 0
+    # 최근 연결 시간 평균 (최근 10개, 누적 합계 사용)
+    recent_count = min(len(server_stats["connection_times"]), RECENT_WINDOW)
+    avg_connection_time = server_stats["recent_total_ms"] / recent_count if recent_count else 0
+    running_count = server_stats["running_count"]
     
     stats = {
         "server_status": "running",
@@ -259,6 +484,7 @@ async def get_stats(request):
         "success_rate": ((server_stats["total_connections"] - server_stats["failed_connections"]) / 
                         max(server_stats["total_connections"], 1)) * 100,
         "average_connection_time_ms": avg_connection_time,
+        "overall_average_connection_time_ms": server_stats["running_total_ms"] / running_count if running_count else 0,
         "memory_usage": {
             "active_peer_connections": len(pcs)
         },
@@ -271,45 +497,53 @@ async def get_stats(request):
         }
     }
     
-    return web.Response(
-        content_type="application/json",
-        text=json.dumps(stats, indent=2)
-    )
+    body = orjson.dumps(stats, option=orjson.OPT_INDENT_2)
+    _stats_cache = (now(), body)
+    response = web.Response(content_type="application/json", body=body)
+    response.enable_compression()
+    return response
 
 async def health_check(request):
-    """헬스 체크 엔드포인트 (Railway용)"""
-    return web.Response(
-        content_type="application/json",
-        text=json.dumps({
-            "status": "healthy",
-            "connections": len(pcs),
-            "timestamp": time.time(),
-            "platform": "Railway"
-        })
-    )
+    """헬스 체크 엔드포인트 (Railway용, 짧은 시간 동안은 직렬화된 응답 재사용)"""
+    global _health_cache
+    cached_at, body = _health_cache
+    if body and now() - cached_at < HEALTH_CACHE_TTL:
+        return web.Response(content_type="application/json", body=body)
+
+    body = orjson.dumps({
+        "status": "healthy",
+        "connections": len(pcs),
+        "timestamp": time.time(),
+        "platform": "Railway"
+    })
+    _health_cache = (now(), body)
+    return web.Response(content_type="application/json", body=body)
 
 async def get_ice_servers_endpoint(request):
     """클라이언트용 ICE 서버 정보 제공 (서버와 동일한 설정)"""
     try:
-        ice_servers = get_ice_servers()
+        await get_ice_servers()
         
-        return web.Response(
+        # iceServers는 캐시 시점에 직렬화해 둔 값을 그대로 사용
+        cache_info = orjson.dumps({
+            "age_seconds": time.time() - _cache_timestamp if _cache_timestamp else 0,
+            "ttl_seconds": _cache_ttl
+        })
+        response = web.Response(
             content_type="application/json",
-            text=json.dumps({
-                "iceServers": ice_servers,
-                "cacheInfo": {
-                    "age_seconds": time.time() - _cache_timestamp if _cache_timestamp else 0,
-                    "ttl_seconds": _cache_ttl
-                }
-            })
+            body=(b'{"iceServers":' + _ice_servers_cache_json +
+                  b',"iceTransportPolicy":' + _ICE_POLICY_JSON +
+                  b',"cacheInfo":' + cache_info + b'}')
         )
+        response.enable_compression()
+        return response
         
     except Exception as e:
-        logging.error(f"ICE 서버 정보 제공 오류: {e}")
+        logger.error("ICE 서버 정보 제공 오류: %s", e)
         # 에러 시 기본 STUN만 제공
         return web.Response(
             content_type="application/json",
-            text=json.dumps({
+            body=orjson.dumps({
                 "iceServers": [
                     {"urls": "stun:stun.l.google.com:19302"},
                     {"urls": "stun:stun1.l.google.com:19302"},
@@ -320,19 +554,16 @@ async def get_ice_servers_endpoint(request):
 
 async def refresh_ice_servers(request):
     """ICE 서버 캐시 강제 새로고침"""
-    global _ice_servers_cache, _cache_timestamp
-    
     try:
         # 캐시 초기화
-        _ice_servers_cache = None
-        _cache_timestamp = 0
+        clear_ice_servers_cache()
         
         # 새로 가져오기
-        ice_servers = get_ice_servers()
+        ice_servers = await get_ice_servers()
         
         return web.Response(
             content_type="application/json",
-            text=json.dumps({
+            body=orjson.dumps({
                 "status": "refreshed",
                 "iceServers": ice_servers,
                 "message": "ICE servers cache refreshed successfully"
@@ -340,21 +571,24 @@ async def refresh_ice_servers(request):
         )
         
     except Exception as e:
-        logging.error(f"ICE 서버 캐시 새로고침 오류: {e}")
+        logger.error("ICE 서버 캐시 새로고침 오류: %s", e)
         return web.Response(
             status=500,
             content_type="application/json",
-            text=json.dumps({"error": str(e)})
+            body=orjson.dumps({"error": str(e)})
         )
 
 def create_app():
     """웹 애플리케이션 생성 및 설정"""
     # 서버 시작 시 ICE 서버 캐시 초기화
-    global _ice_servers_cache, _cache_timestamp
-    _ice_servers_cache = None
-    _cache_timestamp = 0
+    clear_ice_servers_cache()
     
-    app = web.Application()
+    app = web.Application(client_max_size=CLIENT_MAX_SIZE)
+    
+    # 메인 페이지는 실행 중 바뀌지 않으므로 한 번만 읽어 둠
+    with open(os.path.join(ROOT, "static/index.html"), "rb") as f:
+        app["index_body"] = f.read()
+    app["index_etag"] = f'"{hashlib.md5(app["index_body"]).hexdigest()}"'
     
     # CORS 설정
     cors = cors_setup(app, defaults={
@@ -369,6 +603,7 @@ def create_app():
     # 라우트 등록
     app.router.add_get("/", index)
     cors.add(app.router.add_post("/offer", offer))
+    app.router.add_get("/ws", ice_candidates_ws)  # trickle ICE candidate 수신
     cors.add(app.router.add_get("/stats", get_stats))
     cors.add(app.router.add_get("/health", health_check))
     cors.add(app.router.add_get("/ice-servers", get_ice_servers_endpoint))
@@ -377,7 +612,8 @@ def create_app():
     # 정적 파일 서비스
     app.router.add_static("/static", os.path.join(ROOT, "static"))
     
-    # 종료 핸들러 등록
+    # 시작/종료 핸들러 등록
+    app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
     
     return app
@@ -399,9 +635,13 @@ if __name__ == "__main__":
     print("DEBUG: TWILIO_ACCOUNT_SID =", os.environ.get("TWILIO_ACCOUNT_SID"))
     print("DEBUG: TWILIO_AUTH_TOKEN =", "***" if os.environ.get("TWILIO_AUTH_TOKEN") else None)
 
-    logging.info(f"🚀 Starting WebRTC Echo Server on Railway (port {port})")
-    logging.info(f"🔧 Twilio ICE: {'✅ Configured' if os.environ.get('TWILIO_ACCOUNT_SID') else '❌ Not configured'}")
-    logging.info(f"🔧 Custom TURN: {'✅ Configured' if os.environ.get('CUSTOM_TURN_SERVER') else '❌ Not configured'}")
+    logger.info("🚀 Starting WebRTC Echo Server on Railway (port %d)", port)
+    logger.info("🔧 Twilio ICE: %s", '✅ Configured' if os.environ.get('TWILIO_ACCOUNT_SID') else '❌ Not configured')
+    logger.info("🔧 Custom TURN: %s", '✅ Configured' if os.environ.get('CUSTOM_TURN_SERVER') else '❌ Not configured')
     
+    # 기본 asyncio 루프 대신 libuv 기반 uvloop 사용
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     app = create_app()
-    web.run_app(app, host="0.0.0.0", port=port)
+    web.run_app(app, host="0.0.0.0", port=port, backlog=256)